@@ -57,9 +57,7 @@ def main(args):
     else:
         opt_options = json.loads(args.optimization_config)
 
-    params = np.array(
-        np.load(path / PARAMS_FILE, allow_pickle=True).tolist()[0][args.epoch]
-    )
+    params = np.array(np.load(path / PARAMS_FILE)["0"][args.epoch])
 
     nqubits = config["nqubits"]
     nlayers = config["nlayers"]
@@ -12,13 +12,13 @@ from qibo.models.dbi.double_bracket import (
 
 from boostvqe.ansatze import VQE, build_circuit
 from boostvqe.training_utils import Model
-from boostvqe.utils import apply_dbi_steps, rotate_h_with_vqe
+from boostvqe.utils import PARAMS_FILE, apply_dbi_steps, rotate_h_with_vqe
 
 qibo.set_backend("numpy")
 
 # set the path string which define the results
 path = "../results/xyz/sgd_3q_1l_42/"
-paramspath = Path(path + "parameters_history.npy")
+paramspath = Path(path) / PARAMS_FILE
 
 # set the target epoch to which apply DBQA and the number of steps
 target_epoch = 19
@@ -27,7 +27,7 @@ dbi_steps = 1
 # upload system configuration and parameters for all the training
 with open(path + "optimization_results.json") as file:
     config = json.load(file)
-params = np.load(paramspath, allow_pickle=True).tolist()[0]
+params = np.array(np.load(paramspath)["0"])
 
 
 # build circuit, hamiltonian and VQE
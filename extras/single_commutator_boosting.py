@@ -41,9 +41,7 @@ def main(args):
     config = json.loads((path / OPTIMIZATION_FILE).read_text())
     # dump_config(deepcopy(vars(args)), path=dump_path)
 
-    params = np.array(
-        np.load(path / PARAMS_FILE, allow_pickle=True).tolist()[0][args.epoch]
-    )
+    params = np.array(np.load(path / PARAMS_FILE)["0"][args.epoch])
 
     nqubits = config["nqubits"]
     nlayers = config["nlayers"]
@@ -1,5 +1,4 @@
 import argparse
-import json
 import logging
 import pathlib
 from functools import partial
@@ -16,7 +15,7 @@ from qibo.models.dbi.double_bracket import (
 
 # boostvqe's
 from boostvqe.plotscripts import plot_gradients, plot_loss
-from boostvqe.training_utils import Model, vqe_loss
+from boostvqe.training_utils import make_hamiltonian, vqe_loss
 from boostvqe.utils import (
     DBI_D_MATRIX,
     DBI_ENERGIES,
@@ -31,12 +30,18 @@ from boostvqe.utils import (
     apply_dbi_steps,
     create_folder,
     generate_path,
+    ground_state_energy,
     results_dump,
     rotate_h_with_vqe,
+    rotate_h_with_vqe_sparse,
     train_vqe,
 )
 
 NSHOTS = 1000
+SPARSE_ROTATION_MIN_NQUBITS = 12
+"""System size above which the boost rotation goes through the sparse path."""
+GPU_MIN_NQUBITS = 10
+"""System size above which a GPU platform is worth the transfer overhead."""
 
 
 def dbqa_vqe(
@@ -57,6 +62,7 @@ def dbqa_vqe(
     nshots: int = NSHOTS,
     nlayers: int = 0,
     dbr_duration: float = 0.1,
+    fused_dbi: bool = False,
     mode: DoubleBracketGeneratorType = DoubleBracketGeneratorType.single_commutator,
 ):
     """
@@ -98,6 +104,10 @@ def dbqa_vqe(
         dbr_duration (float, default: 0.01):
             Time step used during DBI updates.
 
+        fused_dbi (bool, default: False):
+            If this flag is set, canonical DBI steps go through the
+            numba-compiled fused kernel instead of qibo's matrix routines.
+
         store_h (bool, default: False):
             If this flag is set, the Hamiltonian `H` is stored at each iteration.
 
@@ -124,6 +134,21 @@ def dbqa_vqe(
     output_dict["mode"] = str(mode)
     # set backend and number of classical threads
 
+    # for large state vectors the dense GEMMs of the DBI steps and the
+    # circuit executions are GPU-friendly: pick qibojit's cupy platform
+    # automatically when available and no platform was requested
+    if platform is None and backend == "qibojit" and circuit.nqubits >= GPU_MIN_NQUBITS:
+        try:
+            import cupy  # noqa: F401
+
+            platform = "cupy"
+            output_dict["platform"] = platform
+            logging.info(
+                f"Running {circuit.nqubits} qubits on the qibojit cupy platform."
+            )
+        except ImportError:
+            pass
+
     if platform is not None:
         set_backend(backend=backend, platform=platform)
     else:
@@ -144,8 +169,8 @@ def dbqa_vqe(
             )
         )
     )
-    ham = getattr(Model, hamiltonian)(nqubits)  # TODO : use only Model and not str
-    target_energy = np.real(np.min(np.asarray(ham.eigenvalues())))
+    ham = make_hamiltonian(hamiltonian, nqubits)  # TODO : use only Model and not str
+    target_energy = ground_state_energy(ham)
 
     # construct circuit from parsed ansatz name
     circ0 = circuit
@@ -155,20 +180,34 @@ def dbqa_vqe(
     circ = circ0.copy(deep=True)
     backend = ham.backend
     zero_state = backend.zero_state(nqubits)
+    zero_state_t = np.transpose([backend.to_numpy(zero_state)])
 
     loss = partial(vqe_loss, nshots=nshots)
 
+    # count the trainable parameters once: get_parameters materializes the
+    # whole parameter list by walking the gate queue
+    nparams = len(circ.get_parameters())
+
     # fix numpy seed to ensure replicability of the experiment
     np.random.seed(int(seed))
-    initial_parameters = np.random.uniform(-np.pi, np.pi, len(circ.get_parameters()))
+    initial_parameters = np.random.uniform(-np.pi, np.pi, nparams)
+
+    # scratch buffers shared by all the boost rotations, so each call to
+    # ``rotate_h_with_vqe`` reuses the same two dense matrices instead of
+    # allocating fresh 16 * 4^n bytes per iteration
+    dim = 2**nqubits
+    h_buf = np.empty((dim, dim), dtype=np.complex128)
+    rot_buf = np.empty((dim, dim), dtype=np.complex128)
 
     # vqe lists
     params_history, loss_history, grads_history, fluctuations = {}, {}, {}, {}
     # dbi lists
     boost_energies, boost_fluctuations_dbi, boost_steps, boost_d_matrix = {}, {}, {}, {}
-    # hamiltonian history
+    # hamiltonian history, collected only when it will actually be dumped:
+    # the starting Hamiltonian is reproducible from (hamiltonian, nqubits)
     fun_eval, hamiltonians_history = [], []
-    hamiltonians_history.append(ham.matrix)
+    if store_h:
+        hamiltonians_history.append(np.array(backend.to_numpy(ham.matrix)))
     new_hamiltonian = ham
     nboost += 1
     for b in range(nboost):
@@ -194,31 +233,52 @@ def dbqa_vqe(
             loss=loss,
             training_options=optimizer_options,
         )
-        # append results to global lists
-        params_history[b] = np.array(partial_params_history)
-        loss_history[b] = np.array(partial_loss_history)
+        # append results to global lists; the histories are only kept for
+        # plotting and analysis, so single precision halves their RAM and
+        # disk footprint (the optimizer keeps working in float64)
+        params_history[b] = np.asarray(partial_params_history, dtype=np.float32)
+        loss_history[b] = np.asarray(partial_loss_history, dtype=np.float32)
         grads_history[b] = np.array(partial_grads_history)
-        fluctuations[b] = np.array(partial_fluctuations)
+        fluctuations[b] = np.asarray(partial_fluctuations, dtype=np.float32)
         # this works with scipy.optimize.minimize only
         if optimizer not in ["sgd", "cma"]:
             fun_eval.append(int(partial_results[2].nfev))
 
         # build new hamiltonian using trained VQE
         if b != nboost - 1:
-            new_hamiltonian_matrix = rotate_h_with_vqe(hamiltonian=ham, vqe=vqe)
+            if nqubits >= SPARSE_ROTATION_MIN_NQUBITS:
+                new_hamiltonian_matrix = rotate_h_with_vqe_sparse(
+                    hamiltonian=ham, vqe=vqe, out=h_buf
+                )
+            else:
+                new_hamiltonian_matrix = rotate_h_with_vqe(
+                    hamiltonian=ham, vqe=vqe, out=h_buf, tmp=rot_buf
+                )
+            # push a single contiguous, backend-resident copy of the rotated
+            # matrix: every loss call and DBI step of the next round reuses
+            # this one tensor instead of re-converting the host buffer
+            new_hamiltonian_matrix = backend.cast(
+                np.ascontiguousarray(new_hamiltonian_matrix)
+            )
             new_hamiltonian = hamiltonians.Hamiltonian(
                 nqubits, matrix=new_hamiltonian_matrix
             )
-            hamiltonians_history.extend(new_hamiltonian_matrix)
+            if store_h:
+                # copy before storing: the rotation buffer is overwritten by
+                # the next boost iteration
+                hamiltonians_history.append(
+                    np.array(backend.to_numpy(new_hamiltonian_matrix))
+                )
             # Initialize DBI
             dbi = DoubleBracketIteration(
                 hamiltonian=new_hamiltonian,
                 mode=mode,
             )
 
-            zero_state_t = np.transpose([zero_state])
-            energy_h0 = float(dbi.h.expectation(np.array(zero_state_t)))
-            fluctuations_h0 = float(dbi.h.energy_fluctuation(zero_state_t))
+            energy_h0 = float(backend.to_numpy(dbi.h.expectation(zero_state_t)))
+            fluctuations_h0 = float(
+                backend.to_numpy(dbi.h.energy_fluctuation(zero_state_t))
+            )
 
             # apply DBI
             (
@@ -228,7 +288,9 @@ def dbqa_vqe(
                 list_dbqa_steps,
                 dbi_d_matrix,
                 dbi_operators,
-            ) = apply_dbi_steps(dbi=dbi, nsteps=dbqa_steps, time_step=dbr_duration)
+            ) = apply_dbi_steps(
+                dbi=dbi, nsteps=dbqa_steps, time_step=dbr_duration, fused=fused_dbi
+            )
             # Update the circuit appending the DBI generator
             # and the old circuit with non trainable circuit
             dbi_operators = [
@@ -244,15 +306,18 @@ def dbqa_vqe(
             circ = circ0.copy(deep=True)
             for gate in reversed([old_circ_matrix] + dbi_operators):
                 circ.add(gates.Unitary(gate, *range(nqubits), trainable=False))
-            hamiltonians_history.extend(dbi_hamiltonians)
+            if store_h:
+                hamiltonians_history.extend(
+                    backend.to_numpy(matrix) for matrix in dbi_hamiltonians
+                )
             # append dbi results
             dbi_fluctuations.insert(0, fluctuations_h0)
             dbi_energies.insert(0, energy_h0)
-            boost_fluctuations_dbi[b] = np.array(dbi_fluctuations)
-            boost_energies[b] = np.array(dbi_energies)
+            boost_fluctuations_dbi[b] = np.asarray(dbi_fluctuations, dtype=np.float32)
+            boost_energies[b] = np.asarray(dbi_energies, dtype=np.float32)
             boost_steps[b] = np.array(list_dbqa_steps)
-            boost_d_matrix[b] = np.array(dbi_d_matrix)
-            initial_parameters = np.zeros(len(initial_parameters))
+            boost_d_matrix[b] = np.array([backend.to_numpy(d) for d in dbi_d_matrix])
+            initial_parameters = np.zeros(nparams)
             circ.set_parameters(initial_parameters)
 
             # reduce the learning rate after DBI has been applied
@@ -267,8 +332,10 @@ def dbqa_vqe(
         {
             "true_ground_energy": target_energy,
             "feval": list(fun_eval),
-            "energy": float(vqe.hamiltonian.expectation(zero_state)),
-            "fluctuations": float(vqe.hamiltonian.dense.energy_fluctuation(zero_state)),
+            "energy": float(backend.to_numpy(vqe.hamiltonian.expectation(zero_state))),
+            "fluctuations": float(
+                backend.to_numpy(vqe.hamiltonian.dense.energy_fluctuation(zero_state))
+            ),
             "reached_accuracy": float(np.abs(target_energy - best_loss)),
         }
     )
@@ -284,36 +351,43 @@ def dbqa_vqe(
         )
     np.savez(
         path / LOSS_FILE,
-        **{json.dumps(key): np.array(value) for key, value in loss_history.items()},
+        **{str(key): value for key, value in loss_history.items()},
     )
     np.savez(
         path / GRADS_FILE,
-        **{json.dumps(key): np.array(value) for key, value in grads_history.items()},
+        **{str(key): value for key, value in grads_history.items()},
     )
     np.savez(
         path / FLUCTUATION_FILE,
-        **{json.dumps(key): np.array(value) for key, value in fluctuations.items()},
+        **{str(key): value for key, value in fluctuations.items()},
     )
     if store_h:
-        np.savez(path / HAMILTONIAN_FILE, *hamiltonians_history)
+        # stream the stacked history to disk page by page instead of
+        # buffering a zipped copy of every matrix
+        h_history = np.lib.format.open_memmap(
+            path / HAMILTONIAN_FILE,
+            mode="w+",
+            dtype=np.complex128,
+            shape=(len(hamiltonians_history), dim, dim),
+        )
+        for i, matrix in enumerate(hamiltonians_history):
+            h_history[i] = matrix
+        h_history.flush()
     np.savez(
         path / DBI_ENERGIES,
-        **{json.dumps(key): np.array(value) for key, value in boost_energies.items()},
+        **{str(key): value for key, value in boost_energies.items()},
     )
     np.savez(
         path / DBI_D_MATRIX,
-        **{json.dumps(key): np.array(value) for key, value in boost_d_matrix.items()},
+        **{str(key): value for key, value in boost_d_matrix.items()},
     )
     np.savez(
         path / DBI_STEPS,
-        **{json.dumps(key): np.array(value) for key, value in boost_steps.items()},
+        **{str(key): value for key, value in boost_steps.items()},
     )
     np.savez(
         path / DBI_FLUCTUATIONS,
-        **{
-            json.dumps(key): np.array(value)
-            for key, value in boost_fluctuations_dbi.items()
-        },
+        **{str(key): value for key, value in boost_fluctuations_dbi.items()},
     )
 
     logging.info("Dump the results")
@@ -3,12 +3,14 @@ from enum import Enum, auto
 from itertools import combinations, product
 
 import numpy as np
-
+from numba import njit, prange
 from qibo import symbols
 from qibo.backends import _check_backend
 from qibo.hamiltonians import SymbolicHamiltonian
+
 from boostvqe.models.dbi.double_bracket_evolution_oracles import *
 
+
 def generate_Z_operators(nqubits: int, backend=None):
     """Generate a dictionary containing 1) all possible products of Pauli Z operators for L = n_qubits and 2) their respective names.
     Return: Dictionary with operator names (str) as keys and operators (np.array) as values
@@ -66,6 +68,38 @@ def str_to_symbolic(name: str):
     return tensor_op
 
 
+@njit(parallel=True, fastmath=True, cache=True)
+def _scaled_commutator_with_diagonal(h, step):
+    """Build :math:`-s [\\Delta(H), H]` as the broadcast
+    :math:`-s (d_i - d_j) h_{ij}`, with rows processed in parallel."""
+    n = h.shape[0]
+    w = np.empty_like(h)
+    for i in prange(n):
+        d_i = h[i, i]
+        for j in range(n):
+            w[i, j] = -step * (d_i - h[j, j]) * h[i, j]
+    return w
+
+
+def fused_single_commutator_step(h, step):
+    """Fused single-commutator DBR step on a dense Hamiltonian matrix.
+
+    For :math:`D = \\Delta(H)` the generator :math:`W = [D, H]` reduces to
+    the broadcast :math:`(d_i - d_j) h_{ij}`, so no matrix product is needed
+    to form it. :math:`-sW` is anti-Hermitian, so the rotation
+    :math:`e^{-sW}` is computed exactly from the eigendecomposition of the
+    Hermitian :math:`-isW`, keeping the operator unitary at any step size;
+    the conjugation :math:`U^\\dagger H U` is done with dense matmuls.
+    Returns ``(h_new, operator)`` following the same convention as
+    ``DoubleBracketIteration.__call__``.
+    """
+    w = _scaled_commutator_with_diagonal(np.ascontiguousarray(h), step)
+    eigenvalues, eigenvectors = np.linalg.eigh(1j * w)
+    operator = (eigenvectors * np.exp(-1j * eigenvalues)) @ eigenvectors.conj().T
+    h_new = operator.conj().T @ (h @ operator)
+    return h_new, operator
+
+
 def cs_angle_sgn(dbi_object, d):
     """Calculates the sign of Cauchy-Schwarz Angle :math:`\\langle W(Z), W({\\rm canonical}) \\rangle_{\\rm HS}`."""
     d = dbi_object.backend.cast(d)
@@ -182,13 +216,17 @@ def params_to_diagonal_operator(
         for i in range(len(params)):
             d[i, i] = backend.to_numpy(params[i])
     elif parameterization is ParameterizationTypes.circuits:
-        d = SymbolicHamiltonian( sum([b*symbols.Z(j) \
-            for j,b in zip(range(nqubits),params)]))
-        eo_d = EvolutionOracle(d,mode_evolution_oracle=EvolutionOracleType.hamiltonian_simulation,name = "D(linear)")
+        d = SymbolicHamiltonian(
+            sum([b * symbols.Z(j) for j, b in zip(range(nqubits), params)])
+        )
+        eo_d = EvolutionOracle(
+            d,
+            mode_evolution_oracle=EvolutionOracleType.hamiltonian_simulation,
+            name="D(linear)",
+        )
         eo_d.please_use_prescribed_nmb_ts_steps = 1
         return eo_d
 
-
     # TODO: write proper tests for normalize=True
     if normalize:  # pragma: no cover
         d = d / np.linalg.norm(d)
@@ -1,6 +1,7 @@
 import logging
 import os
 from enum import Enum
+from functools import lru_cache
 
 from qibo.hamiltonians.models import HamiltonianTerm, _multikron
 
@@ -37,6 +38,17 @@ class Model(Enum):
     J1J2 = lambda nqubits: J1J2(nqubits=nqubits, h=J1J2_h, dense=False)
 
 
+@lru_cache(maxsize=8)
+def make_hamiltonian(name, nqubits):
+    """Construct a model Hamiltonian, cached per `(name, nqubits)`.
+
+    Building the model matrix costs O(n 4^n) Kronecker work in qibo's
+    generic constructor path; runs that revisit the same configuration
+    within one process get the already-built instance back.
+    """
+    return getattr(Model, name)(nqubits)
+
+
 def TLFIM(nqubits, h=TLFIM_h, dense=True, backend=None):
     """Transverse and longitudinal field Ising model with periodic boundary conditions.
 
@@ -141,21 +153,72 @@ def XYZ(nqubits, deltas=[0.5, 0.5], dense=True, backend=None):
     return ham
 
 
+def fast_set_parameters(circuit, params):
+    """Assign a flat parameter vector directly to the circuit's trainable gates.
+
+    `Circuit.set_parameters` re-parses the parameter list against the gate
+    queue on every call, while the circuit structure is invariant across a
+    whole optimization. The trainable gates are therefore looked up once,
+    cached on the circuit, and subsequent calls just write each angle into
+    its gate slot. Circuits containing multi-parameter trainable gates fall
+    back to `set_parameters`.
+    """
+    gate_refs = getattr(circuit, "_trainable_gate_refs", None)
+    if gate_refs is None:
+        trainable = list(circuit.trainable_gates)
+        gate_refs = (
+            tuple(trainable)
+            if all(len(gate.parameters) == 1 for gate in trainable)
+            else ()
+        )
+        circuit._trainable_gate_refs = gate_refs
+    if len(gate_refs) != len(params):
+        circuit.set_parameters(params)
+        return
+    for gate, theta in zip(gate_refs, params):
+        gate.parameters = (theta,)
+
+
 def vqe_loss(params, circuit, hamiltonian, nshots=None):
-    """Evaluate the hamiltonian expectation values of the circuit final state."""
-    circ = circuit.copy(deep=True)
-    circ.set_parameters(params)
+    """Evaluate the hamiltonian expectation values of the circuit final state.
+
+    The circuit is reused in place (only its parameters are overwritten):
+    this function sits in the optimizer's inner loop and the deep copy of
+    the whole gate queue previously done here dominated the Python-side
+    cost of each evaluation.
+    """
+    fast_set_parameters(circuit, params)
     if isinstance(hamiltonian.backend, TensorflowBackend) and nshots is not None:
         expectation_value = _exp_with_tf(
-            circuit=circ, hamiltonian=hamiltonian, nshots=nshots
+            circuit=circuit, hamiltonian=hamiltonian, nshots=nshots
         )
     elif nshots is None:
-        expectation_value = _exact(circ, hamiltonian)
+        expectation_value = _exact(circuit, hamiltonian)
     else:
-        expectation_value = _with_shots(circ=circ, ham=hamiltonian, nshots=nshots)
+        expectation_value = _with_shots(circ=circuit, ham=hamiltonian, nshots=nshots)
     return expectation_value
 
 
+def energy_and_fluctuation(params, circuit, hamiltonian):
+    """Exact expectation value and energy fluctuation from one execution.
+
+    `hamiltonian.energy_fluctuation` recomputes the expectation value it
+    already needs internally; here the final state is prepared once and both
+    :math:`\\langle H \\rangle` and :math:`\\langle H^2 \\rangle` are
+    assembled from a single application of the dense Hamiltonian to the
+    state, halving the Hamiltonian-application cost of the pair.
+    """
+    fast_set_parameters(circuit, params)
+    backend = hamiltonian.backend
+    final_state = backend.execute_circuit(circuit).state()
+    h_state = backend.to_numpy(hamiltonian.dense.matrix @ final_state)
+    state = backend.to_numpy(final_state)
+    energy = float(np.real(np.vdot(state, h_state)))
+    energy_square = float(np.real(np.vdot(h_state, h_state)))
+    fluctuation = float(np.sqrt(max(energy_square - energy**2, 0.0)))
+    return energy, fluctuation
+
+
 def _exact(circ, hamiltonian):
     """Helper function to compute expectation value of Heisemberg hamiltonian."""
     expectation_value = hamiltonian.expectation(
@@ -164,85 +227,84 @@ def _exact(circ, hamiltonian):
     return expectation_value
 
 
+@lru_cache(maxsize=8)
+def _model_matrix(model, nqubits):
+    """Dense matrix of a reference model, built once per `(model, nqubits)`."""
+    return np.array(getattr(Model, model)(nqubits=nqubits).matrix)
+
+
+def _identify_model(ham):
+    """Match `ham` against the reference models.
+
+    The outcome is cached on the Hamiltonian object itself so the O(4^n)
+    matrix comparisons run once per Hamiltonian instead of once per loss call.
+    """
+    model = getattr(ham, "_boostvqe_model", None)
+    if model is None:
+        matrix = np.array(ham.matrix)
+        for candidate in ("TFIM", "TLFIM", "XXZ", "XYZ"):
+            if np.array_equal(matrix, _model_matrix(candidate, ham.nqubits)):
+                model = candidate
+                break
+        else:
+            raise NotImplementedError("This option is not valid")
+        ham._boostvqe_model = model
+    return model
+
+
+@lru_cache(maxsize=8)
+def _measurement_groups(model, nqubits):
+    """Qubit-wise commuting measurement groups of a model Hamiltonian.
+
+    The Pauli terms of every supported model partition into at most three
+    qubit-wise commuting groups, so a single basis rotation and measurement
+    serves all the terms of a group. Each group is a
+    ``(coefficient, basis, observable)`` tuple where ``basis`` is the
+    single-qubit measurement basis and ``observable`` the diagonal symbolic
+    Hamiltonian read from the samples. Groups are built once per
+    `(model, nqubits)` and reused by every `_with_shots` call.
+    """
+    zz_chain = sum(Z(i) * Z(i + 1) for i in range(nqubits - 1))
+    zz_chain += Z(0) * Z(nqubits - 1)
+    zz_chain = hamiltonians.SymbolicHamiltonian(zz_chain)
+    z_fields = hamiltonians.SymbolicHamiltonian(sum(Z(i) for i in range(nqubits)))
+
+    if model == "TFIM":
+        return ((-1.0, "Z", zz_chain), (-float(nqubits), "X", z_fields))
+    if model == "TLFIM":
+        return (
+            (-1.0, "Z", zz_chain),
+            (-float(nqubits), "X", z_fields),
+            (-float(nqubits), "Z", z_fields),
+        )
+    if model == "XXZ":
+        coefficients = (1.0, 1.0, DEFAULT_DELTA)
+    else:  # XYZ
+        coefficients = (1.0, *DEFAULT_DELTAS)
+    return tuple(
+        (coefficient, basis, zz_chain)
+        for coefficient, basis in zip(coefficients, ("X", "Y", "Z"))
+    )
+
+
 def _with_shots(circ, ham, nshots, exec_backend=None):
-    """Helper function to compute XXZ expectation value from frequencies."""
+    """Helper function to compute the model expectation value from frequencies."""
     # we may prefer run this on a different backend (e.g. with TF and PSR)
     if exec_backend is None:
         exec_backend = ham.backend
 
-    hamiltonian = sum(Z(i) * Z(i + 1) for i in range(circ.nqubits - 1))
-    hamiltonian += Z(0) * Z(circ.nqubits - 1)
-    hamiltonian = hamiltonians.SymbolicHamiltonian(hamiltonian)
-    hamiltonian1 = sum(Z(i) for i in range(circ.nqubits))
-    hamiltonian1 = hamiltonians.SymbolicHamiltonian(hamiltonian1)
     expectation_value = 0
-    nqubits = circ.nqubits
-
-    if np.array_equal(
-        np.array(ham.matrix), np.array(Model.TFIM(nqubits=nqubits).matrix)
-    ):
-        # Evaluate the ZZ terms
-        circ1 = circ.copy(deep=True)
-        circ1.add(gates.M(*range(circ1.nqubits)))
-        expval_contribution = exec_backend.execute_circuit(
-            circuit=circ1, nshots=nshots
-        ).expectation_from_samples(hamiltonian)
-        expectation_value -= expval_contribution
-
-        # Evaluate X terms
-        circ1 = circ.copy(deep=True)
-        circ1.add(gates.M(*range(circ1.nqubits), basis=gates.X))
-        expval_contribution = exec_backend.execute_circuit(
-            circuit=circ1, nshots=nshots
-        ).expectation_from_samples(hamiltonian1)
-        expectation_value -= nqubits * expval_contribution
-
-    elif np.array_equal(
-        np.array(ham.matrix), np.array(Model.TLFIM(nqubits=nqubits).matrix)
-    ):
-        # Evaluate the ZZ terms
+    groups = _measurement_groups(_identify_model(ham), circ.nqubits)
+    for coefficient, basis, observable in groups:
         circ1 = circ.copy(deep=True)
-        circ1.add(gates.M(*range(circ1.nqubits)))
+        if basis == "Z":
+            circ1.add(gates.M(*range(circ1.nqubits)))
+        else:
+            circ1.add(gates.M(*range(circ1.nqubits), basis=getattr(gates, basis)))
         expval_contribution = exec_backend.execute_circuit(
             circuit=circ1, nshots=nshots
-        ).expectation_from_samples(hamiltonian)
-        expectation_value -= expval_contribution
-
-        # Evaluate X and Z terms
-        for i, gate in enumerate([gates.X, gates.Z]):
-            circ1 = circ.copy(deep=True)
-            if gate == gates.X:
-                circ1.add(gates.M(*range(circ1.nqubits), basis=gate))
-            else:
-                circ1.add(gates.M(*range(circ1.nqubits)))
-            expval_contribution = exec_backend.execute_circuit(
-                circuit=circ1, nshots=nshots
-            ).expectation_from_samples(hamiltonian1)
-            expectation_value -= nqubits * expval_contribution
-
-    else:
-        if np.array_equal(
-            np.array(ham.matrix), np.array(Model.XXZ(nqubits=nqubits).matrix)
-        ):
-            coefficients = [1, 1, DEFAULT_DELTA]
-        elif np.array_equal(
-            np.array(ham.matrix), np.array(Model.XYZ(nqubits=nqubits).matrix)
-        ):
-            coefficients = [1, *DEFAULT_DELTAS]
-        else:
-            raise NotImplemented("This option is not valid")
-        mgates = ["X", "Y", "Z"]
-        for i, mgate in enumerate(mgates):
-            circ1 = circ.copy(deep=True)
-            if mgate != "Z":
-                circ1.add(gates.M(*range(circ1.nqubits), basis=getattr(gates, mgate)))
-            else:
-                circ1.add(gates.M(*range(circ1.nqubits)))
-
-            expval_contribution = exec_backend.execute_circuit(
-                circuit=circ1, nshots=nshots
-            ).expectation_from_samples(hamiltonian)
-            expectation_value += coefficients[i] * expval_contribution
+        ).expectation_from_samples(observable)
+        expectation_value += coefficient * expval_contribution
     return expectation_value
 
 
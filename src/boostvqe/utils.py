@@ -2,28 +2,42 @@ import copy
 import json
 import logging
 import time
+from functools import partial
 from pathlib import Path
 
 import cma
 import matplotlib.pyplot as plt
 import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 from qibo import hamiltonians
 from qibo.models.dbi.utils_scheduling import hyperopt_step
 from scipy import optimize
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import eigsh
 
 from boostvqe import ansatze
 from boostvqe.compiling_XXZ import *
 from boostvqe.models.dbi.double_bracket_evolution_oracles import *
 from boostvqe.models.dbi.group_commutator_iteration_transpiler import *
+from boostvqe.models.dbi.utils import fused_single_commutator_step
+from boostvqe.training_utils import (
+    energy_and_fluctuation,
+    fast_set_parameters,
+    vqe_loss,
+)
 
 OPTIMIZATION_FILE = "optimization_results.json"
-PARAMS_FILE = "parameters_history.npy"
+PARAMS_FILE = "parameters_history.npz"
 PLOT_FILE = "energy.pdf"
 ROOT_FOLDER = "results"
 FLUCTUATION_FILE = "fluctuations"
 LOSS_FILE = "energies"
 GRADS_FILE = "gradients"
-HAMILTONIAN_FILE = "hamiltonian_matrix.npz"
+HAMILTONIAN_FILE = "hamiltonian_matrix.npy"
 SEED = 42
 DELTA = 0.5
 TOL = 1e-10
@@ -31,6 +45,11 @@ DBI_ENERGIES = "dbi_energies"
 DBI_FLUCTUATIONS = "dbi_fluctuations"
 DBI_STEPS = "dbi_steps"
 DBI_D_MATRIX = "dbi_d_matrices"
+GRADIENT_OPTIMIZERS = ("L-BFGS-B", "BFGS", "CG", "TNC", "SLSQP")
+"""Scipy methods trained with analytic parameter-shift gradients."""
+PARAMETER_SHIFT_GATES = frozenset(("rx", "ry", "rz", "rxx", "ryy", "rzz"))
+"""Gates with generator eigenvalues of +-1/2, for which the two-term
+:math:`\\pi/2` parameter-shift rule is exact."""
 
 
 logging.basicConfig(level=logging.INFO)
@@ -59,15 +78,30 @@ def create_folder(path: str) -> Path:
     return path
 
 
-def results_dump(path: str, results: np.array, output_dict: dict):
-    """Dump"""
-    np.save(file=f"{path}/{PARAMS_FILE}", arr=results)
+def results_dump(path: str, results: dict, output_dict: dict):
+    """Dump the parameter histories and the run configuration.
+
+    The per-boost parameter arrays are stored as plain npz entries keyed by
+    the boost index instead of one pickled dict object, so the dump is a
+    straight buffer write and loading back does not require allow_pickle.
+    """
+    np.savez(
+        f"{path}/{PARAMS_FILE}",
+        **{str(key): value for key, value in results.items()},
+    )
     json_file = Path(f"{path}/{OPTIMIZATION_FILE}")
     dump_json(json_file, output_dict)
 
 
 def dump_json(path: Path, data):
-    path.write_text(json.dumps(data, indent=4))
+    # orjson serializes the metadata dict considerably faster than the
+    # stdlib encoder; fall back to json when it is not installed
+    if orjson is not None:
+        path.write_bytes(
+            orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+        )
+    else:
+        path.write_text(json.dumps(data, indent=4))
 
 
 def json_load(path: str):
@@ -77,13 +111,137 @@ def json_load(path: str):
 
 def callback_energy_fluctuations(params, circuit, hamiltonian):
     """Evaluate the energy fluctuations"""
-    circ = circuit.copy(deep=True)
-    circ.set_parameters(params)
-    result = hamiltonian.backend.execute_circuit(circ)
+    fast_set_parameters(circuit, params)
+    result = hamiltonian.backend.execute_circuit(circuit)
     final_state = result.state()
     return hamiltonian.dense.energy_fluctuation(final_state)
 
 
+def ground_state_energy(hamiltonian, tol=1e-8):
+    """Smallest eigenvalue of `hamiltonian` via sparse Lanczos.
+
+    Only the ground-state energy is needed for the target accuracy, so a
+    full dense eigendecomposition (O(8^n)) is wasteful; for the
+    nearest-neighbor Pauli models used here the sparse operator has
+    O(n 2^n) nonzeros and ARPACK with ``k=1`` converges in a handful of
+    matrix-vector products.
+    """
+    matrix = csr_matrix(hamiltonian.backend.to_numpy(hamiltonian.matrix))
+    return float(eigsh(matrix, k=1, which="SA", tol=tol, return_eigenvectors=False)[0])
+
+
+def _supports_parameter_shift(circuit):
+    """Whether every trainable gate admits the two-term shift rule.
+
+    Gates such as ``RBS`` (used by :func:`boostvqe.ansatze.hw_preserving`)
+    have generator eigenvalues :math:`\\{0, \\pm 1\\}` and need the unrolled
+    rule of :func:`boostvqe.training_utils.quantum_derivative_via_shifts`
+    instead, so circuits containing them must not go through
+    :func:`parameter_shift_gradient`.
+    """
+    return all(gate.name in PARAMETER_SHIFT_GATES for gate in circuit.trainable_gates)
+
+
+def parameter_shift_gradient(params, circuit, hamiltonian, loss):
+    """Compute the gradient of `loss` with the parameter-shift rule.
+
+    Each component is evaluated as
+    :math:`(E(\\theta + \\pi/2 e_i) - E(\\theta - \\pi/2 e_i)) / 2`,
+    namely two `loss` calls per parameter, reusing the same `circuit` object
+    via `set_parameters` so the backend gate kernels are not rebuilt.
+    Only valid for rotation gates with generator eigenvalues
+    :math:`\\pm 1/2` (shift of :math:`\\pi/2`); callers must check the
+    circuit with :func:`_supports_parameter_shift` first.
+    """
+    backend = hamiltonian.backend
+    params = np.asarray(params, dtype=float)
+    nparams = params.shape[0]
+    # stack the 2 * nparams shifted parameter vectors in one batch so the
+    # shift pattern is built with a single vectorized pass instead of
+    # per-component copies
+    shifts = np.tile(params, (2 * nparams, 1))
+    rows = np.arange(nparams)
+    shifts[2 * rows, rows] += np.pi / 2
+    shifts[2 * rows + 1, rows] -= np.pi / 2
+    energies = np.fromiter(
+        (
+            float(backend.to_numpy(loss(shifted, circuit, hamiltonian)))
+            for shifted in shifts
+        ),
+        dtype=float,
+        count=2 * nparams,
+    )
+    return 0.5 * (energies[0::2] - energies[1::2])
+
+
+def _minimize_with_gradients(
+    vqe, initial_parameters, method, tol, loss, callback, options
+):
+    """Scipy minimization of the VQE loss fed with parameter-shift gradients.
+
+    Gradient-based scipy methods require O(nparams) expectation evaluations
+    per descent step instead of the O(nparams^2) line searches performed by
+    derivative-free methods such as Powell, so far fewer circuit executions
+    are needed overall. The `(loss, gradient)` pair is returned from a single
+    objective with `jac=True` and one circuit object is reused for every
+    (shifted) evaluation.
+    """
+    circuit = vqe.circuit
+    hamiltonian = vqe.hamiltonian
+    backend = hamiltonian.backend
+
+    def fun_and_jac(params):
+        energy = float(backend.to_numpy(loss(params, circuit, hamiltonian)))
+        gradient = parameter_shift_gradient(params, circuit, hamiltonian, loss)
+        return energy, gradient
+
+    results = optimize.minimize(
+        fun_and_jac,
+        initial_parameters,
+        jac=True,
+        method=method,
+        tol=tol,
+        callback=callback,
+        options=options,
+    )
+    vqe.circuit.set_parameters(results.x)
+    return results.fun, results.x, results
+
+
+def _minimize_with_cma(vqe, initial_parameters, tol, loss, callback, options):
+    """CMA-ES minimization of the VQE loss with generation-batched evaluations.
+
+    Powell's conjugate-direction updates degrade beyond ~50 parameters,
+    while CMA-ES keeps making progress on smooth VQE landscapes and samples
+    its whole population up front, so each generation evaluates all the
+    candidate parameter vectors in one pass over a shared circuit. The
+    population size follows the standard :math:`4 + 3 \\ln(n)` rule (at
+    least 8); entries of `options` are forwarded to `CMAEvolutionStrategy`.
+    """
+    circuit = vqe.circuit
+    hamiltonian = vqe.hamiltonian
+    backend = hamiltonian.backend
+    nparams = len(initial_parameters)
+    cma_options = {
+        "popsize": max(8, 4 + int(3 * np.log(nparams))),
+        "tolfun": tol,
+    }
+    cma_options.update(options)
+    sigma0 = cma_options.pop("sigma0", 0.3)
+    es = cma.CMAEvolutionStrategy(initial_parameters, sigma0, cma_options)
+    while not es.stop():
+        population = es.ask()
+        energies = [
+            float(backend.to_numpy(loss(candidate, circuit, hamiltonian)))
+            for candidate in population
+        ]
+        es.tell(population, energies)
+        callback(np.array(es.best.x))
+    best_params = np.array(es.result.xbest)
+    vqe.circuit.set_parameters(best_params)
+    return es.result.fbest, best_params, es.result
+
+
 def train_vqe(
     circ,
     ham,
@@ -96,11 +254,22 @@ def train_vqe(
     training_options=None,
 ):
     """Helper function which trains the VQE according to `circ` and `ham`."""
-    params_history, loss_list, fluctuations, grads_history = (
-        [],
-        [],
-        [],
-        [],
+    nparams = len(initial_parameters)
+    # preallocate the parameter/loss histories: the optimizer triggers one
+    # callback per iteration and thousands of small list appends otherwise
+    # fragment the heap; the buffers double when full and the unused tail is
+    # truncated on return
+    capacity = niterations + 1 if niterations is not None else 128
+    params_history = np.empty((capacity, nparams))
+    loss_history = np.empty(capacity)
+    fluctuations, grads_history = [], []
+    iteration = 0
+    # with the exact (statevector) loss, energy and fluctuation share one
+    # circuit execution and one Hamiltonian application
+    exact_loss = (
+        isinstance(loss, partial)
+        and loss.func is vqe_loss
+        and loss.keywords.get("nshots") is None
     )
 
     if training_options is None:
@@ -115,32 +284,35 @@ def train_vqe(
         hamiltonian=ham,
     )
 
-    def callbacks(
-        params,
-        vqe=vqe,
-        loss_list=loss_list,
-        loss_fluctuation=fluctuations,
-        params_history=params_history,
-        grads_history=grads_history,
-        loss=loss,
-    ):
+    def callbacks(params):
         """
         Callback function that updates the energy, the energy fluctuations and
-        the parameters lists.
+        the parameters histories.
         """
-        energy = loss(params, vqe.circuit, vqe.hamiltonian)
-        loss_list.append(float(energy))
-        loss_fluctuation.append(
-            callback_energy_fluctuations(params, vqe.circuit, vqe.hamiltonian)
-        )
-        params_history.append(copy.deepcopy(params))
+        nonlocal params_history, loss_history, iteration
+        if iteration == loss_history.shape[0]:
+            params_history = np.resize(params_history, (2 * iteration, nparams))
+            loss_history = np.resize(loss_history, 2 * iteration)
+        if exact_loss:
+            energy, fluctuation = energy_and_fluctuation(
+                params, vqe.circuit, vqe.hamiltonian
+            )
+        else:
+            energy = loss(params, vqe.circuit, vqe.hamiltonian)
+            fluctuation = callback_energy_fluctuations(
+                params, vqe.circuit, vqe.hamiltonian
+            )
+        loss_history[iteration] = float(energy)
+        params_history[iteration] = params
+        fluctuations.append(fluctuation)
         grads_history.append(
             ansatze.compute_gradients(
                 parameters=params, circuit=circ.copy(deep=True), hamiltonian=ham
             )
         )
 
-        iteration_count = len(loss_list) - 1
+        iteration_count = iteration
+        iteration += 1
 
         if niterations is not None and iteration_count % nmessage == 0:
             logging.info(f"Optimization iteration {iteration_count}/{niterations}")
@@ -149,40 +321,119 @@ def train_vqe(
     callbacks(initial_parameters)
     logging.info("Minimize the energy")
 
-    results = vqe.minimize(
-        initial_parameters,
-        method=optimizer,
-        callback=callbacks,
-        tol=tol,
-        loss_func=loss,
-        options=options,
-    )
+    use_parameter_shift = optimizer in GRADIENT_OPTIMIZERS
+    if use_parameter_shift and not _supports_parameter_shift(circ):
+        logging.warning(
+            f"{optimizer} requested but the circuit contains trainable gates "
+            "without +-1/2 generator eigenvalues (e.g. RBS): falling back to "
+            "qibo's generic minimization."
+        )
+        use_parameter_shift = False
+
+    if use_parameter_shift:
+        results = _minimize_with_gradients(
+            vqe,
+            initial_parameters,
+            optimizer,
+            tol,
+            loss,
+            callbacks,
+            options,
+        )
+    elif optimizer == "cma":
+        results = _minimize_with_cma(
+            vqe,
+            initial_parameters,
+            tol,
+            loss,
+            callbacks,
+            options,
+        )
+    else:
+        results = vqe.minimize(
+            initial_parameters,
+            method=optimizer,
+            callback=callbacks,
+            tol=tol,
+            loss_func=loss,
+            options=options,
+        )
 
     return (
         results,
-        params_history,
-        loss_list,
+        params_history[:iteration],
+        loss_history[:iteration],
         grads_history,
         fluctuations,
         vqe,
     )
 
 
-def rotate_h_with_vqe(hamiltonian, vqe):
-    """Rotate `hamiltonian` using the unitary representing the `vqe`."""
+def rotate_h_with_vqe(hamiltonian, vqe, out=None, tmp=None):
+    """Rotate `hamiltonian` using the unitary representing the `vqe`.
+
+    If the scratch buffers `out` and `tmp` are provided (two preallocated
+    2^n x 2^n complex arrays), the two matrix products are written in place
+    so that repeated rotations (e.g. one per boost iteration) do not allocate
+    fresh dense matrices each time.
+    """
     # inherit backend from hamiltonian and circuit from vqe
     backend = hamiltonian.backend
     circuit = vqe.circuit
     # create circuit matrix and compute the rotation
-    matrix_circ = np.matrix(backend.to_numpy(circuit.unitary()))
-    matrix_circ_dagger = backend.cast(np.array(matrix_circ.getH()))
-    matrix_circ = backend.cast(matrix_circ)
-    new_hamiltonian = matrix_circ_dagger @ hamiltonian.matrix @ np.array(matrix_circ)
-    return new_hamiltonian
+    matrix_circ = backend.to_numpy(circuit.unitary())
+    h_matrix = backend.to_numpy(hamiltonian.matrix)
+    if out is None or tmp is None:
+        return matrix_circ.conj().T @ h_matrix @ matrix_circ
+    np.matmul(h_matrix, matrix_circ, out=tmp)
+    np.matmul(matrix_circ.conj().T, tmp, out=out)
+    return out
+
+
+def rotate_h_with_vqe_sparse(hamiltonian, vqe, out=None):
+    """Rotate `hamiltonian` with the VQE unitary without materializing it.
+
+    Computes :math:`U^\\dagger H U` column by column as
+    :math:`U^\\dagger (H (U |e_j\\rangle))`: each basis column is pushed
+    through the circuit, multiplied by the sparse Hamiltonian and pulled
+    back through the inverted circuit. For the nearest-neighbor Pauli
+    models the sparse matvec is O(n 2^n) versus the O(4^n) rows of a dense
+    product, so for large `nqubits` this avoids both building the dense
+    circuit unitary and the dense triple product of `rotate_h_with_vqe`.
+    """
+    backend = hamiltonian.backend
+    circuit = vqe.circuit
+    inverse = circuit.invert()
+    h_sparse = csr_matrix(backend.to_numpy(hamiltonian.matrix))
+    dim = 2**hamiltonian.nqubits
+    if out is None:
+        out = np.empty((dim, dim), dtype=np.complex128)
+    basis_state = np.zeros(dim, dtype=np.complex128)
+    for j in range(dim):
+        basis_state[j] = 1.0
+        column = backend.to_numpy(
+            backend.execute_circuit(circuit, initial_state=basis_state.copy()).state()
+        )
+        column = h_sparse @ column
+        out[:, j] = backend.to_numpy(
+            backend.execute_circuit(inverse, initial_state=column).state()
+        )
+        basis_state[j] = 0.0
+    return out
 
 
-def apply_dbi_steps(dbi, nsteps, d_type=None, method=None, time_step=0.01, **kwargs):
-    """Apply `nsteps` of `dbi` to `hamiltonian`."""
+def apply_dbi_steps(
+    dbi, nsteps, d_type=None, method=None, time_step=0.01, fused=False, **kwargs
+):
+    """Apply `nsteps` of `dbi` to `hamiltonian`.
+
+    With ``fused=True`` (and the default canonical diagonal ``d``), each step
+    goes through the numba-compiled
+    :func:`boostvqe.models.dbi.utils.fused_single_commutator_step` kernel,
+    which forms the commutator by broadcasting against the diagonal and
+    conjugates with the exact exponential of the anti-Hermitian generator,
+    instead of qibo's Python-level commutator/expm dispatch.
+    """
     nqubits = dbi.nqubits
 
     p0 = [time_step]
@@ -194,6 +445,10 @@ def apply_dbi_steps(dbi, nsteps, d_type=None, method=None, time_step=0.01, **kwa
     energies, fluctuations, hamiltonians, steps, d_matrix = [], [], [], [], []
     logging.info(f"Applying {nsteps} steps of DBI to the given hamiltonian.")
     operators = []
+    # the reference state is fixed: allocate the 2^n buffer once instead of
+    # asking the backend for a fresh zero state at every step
+    backend = dbi.h.backend
+    zero_state = np.transpose([backend.to_numpy(backend.zero_state(dbi.h.nqubits))])
     for _ in range(nsteps):
         logging.info(f"step {_+1}")
 
@@ -207,17 +462,30 @@ def apply_dbi_steps(dbi, nsteps, d_type=None, method=None, time_step=0.01, **kwa
             step = p0[0]
             new_d = dbi.diagonal_h_matrix
 
-        operator = dbi(step=step, d=new_d)
+        if fused and d_type is None:
+            h_old = np.ascontiguousarray(backend.to_numpy(dbi.h.matrix))
+            h_new, operator = fused_single_commutator_step(h_old, step)
+            # the rotation is a unitary conjugation, so the trace is
+            # preserved up to roundoff scaled by the magnitude of H
+            atol = 1e-10 * max(1.0, np.linalg.norm(h_old))
+            if not np.isclose(np.trace(h_new), np.trace(h_old), atol=atol):
+                raise ValueError(
+                    "fused DBR step did not preserve the trace of H: "
+                    "rerun with fused=False."
+                )
+            dbi.h.matrix = backend.cast(h_new)
+            operator = backend.cast(operator)
+        else:
+            operator = dbi(step=step, d=new_d)
 
         operators.append(operator)
         steps.append(step)
         d_matrix.append(new_d)
-        zero_state = np.transpose([dbi.h.backend.zero_state(dbi.h.nqubits)])
 
         logging.info(f"\nH matrix: {dbi.h.matrix}\n")
 
-        energies.append(dbi.h.expectation(zero_state))
-        fluctuations.append(dbi.energy_fluctuation(zero_state))
+        energies.append(float(backend.to_numpy(dbi.h.expectation(zero_state))))
+        fluctuations.append(float(backend.to_numpy(dbi.energy_fluctuation(zero_state))))
         hamiltonians.append(dbi.h.matrix)
 
         logging.info(f"DBI energies: {energies}")
@@ -1,8 +1,13 @@
 import argparse
 import json
 import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
 
 import qibo
+from qibo.models.dbi.double_bracket import DoubleBracketGeneratorType
 
 from boostvqe import ansatze
 from boostvqe.boost import dbqa_vqe
@@ -28,11 +33,15 @@ def main():
     parser.add_argument("--circuit_ansatz", type=str, help="Circuit ansatz.")
     parser.add_argument(
         "--nqubits",
-        type=int,
-        help="Number of particles of the problem. It will fix the number of qubits.",
+        type=str,
+        help="Number of particles of the problem. It will fix the number of "
+        "qubits. Accepts a comma-separated list to sweep.",
     )
     parser.add_argument(
-        "--nlayers", type=int, help="Number of layers of the VQE ansatz."
+        "--nlayers",
+        type=str,
+        help="Number of layers of the VQE ansatz. Accepts a comma-separated "
+        "list to sweep.",
     )
 
     # Optional arguments with defaults matching the function signature
@@ -81,6 +90,11 @@ def main():
     parser.add_argument(
         "--store_h", action="store_true", help="Store Hamiltonian at each iteration."
     )
+    parser.add_argument(
+        "--fused_dbi",
+        action="store_true",
+        help="Run canonical DBI steps through the numba-compiled fused kernel.",
+    )
     parser.add_argument(
         "--hamiltonian",
         type=str,
@@ -92,14 +106,58 @@ def main():
     parser.add_argument(
         "--mode", type=str, default="single_commutator", help="DBI generator mode."
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=None,
+        help="Worker processes used to run parameter sweeps in parallel.",
+    )
 
     args = parser.parse_args()
 
     # Set up logging
     logging.basicConfig(level=logging.INFO)
 
+    nqubits_list = [int(n) for n in str(args.nqubits).split(",")]
+    nlayers_list = [int(n) for n in str(args.nlayers).split(",")]
+    sweep = list(product(nqubits_list, nlayers_list))
+
+    if len(sweep) == 1:
+        run_single(args, *sweep[0])
+    else:
+        # each (nqubits, nlayers) job writes to its own results folder, so
+        # the sweep is embarrassingly parallel across processes
+        max_workers = args.max_workers or min(len(sweep), os.cpu_count())
+        threads_per_worker = max(1, os.cpu_count() // max_workers)
+        # spawned workers inherit the environment set here before their
+        # first numpy import, so the BLAS thread pools honour the limit
+        # (with fork the parent's already-initialized BLAS would win)
+        os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_limit_worker_threads,
+            initargs=(threads_per_worker,),
+        ) as executor:
+            futures = [
+                executor.submit(run_single, args, nqubits, nlayers)
+                for nqubits, nlayers in sweep
+            ]
+            for future in futures:
+                future.result()
+
+
+def _limit_worker_threads(nthreads):
+    """Share the physical cores evenly between the sweep workers."""
+    qibo.set_threads(nthreads)
+
+
+def run_single(args, nqubits, nlayers):
+    """Run one DBQA VQE job for a single `(nqubits, nlayers)` combination."""
+    logging.basicConfig(level=logging.INFO)
+
     # Load or construct the circuit from the given file path
-    circuit = getattr(ansatze, args.circuit_ansatz)(args.nqubits, args.nlayers)
+    circuit = getattr(ansatze, args.circuit_ansatz)(nqubits, nlayers)
 
     # Run the DBQA VQE function
     dbqa_vqe(
@@ -113,13 +171,14 @@ def main():
         decay_rate_lr=args.decay_rate_lr,
         nboost=args.nboost,
         boost_frequency=args.boost_frequency,
-        dbi_steps=args.dbi_steps,
+        dbqa_steps=args.dbi_steps,
         store_h=args.store_h,
         hamiltonian=args.hamiltonian,
         seed=args.seed,
         nshots=args.nshots,
-        nlayers=args.nlayers,
-        mode=args.mode,
+        nlayers=nlayers,
+        fused_dbi=args.fused_dbi,
+        mode=DoubleBracketGeneratorType[args.mode],
     )
 
 